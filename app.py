@@ -1,9 +1,14 @@
-from fastapi import FastAPI, HTTPException
+from datetime import datetime
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from analyses.customer_analysis import analyze_customers
-from analyses.product_analysis import analyze_products
+from analyses.product_analysis import analyze_products, plot_products
 from analyses.supplier_analysis import analyze_suppliers
 from analyses.country_analysis import analyze_countries
+from utils import get_cached_analysis, get_cached_view, refresh_analysis, is_refresh_leader, warm_db_pool
+from config import ANALYSIS_REFRESH_INTERVAL
+from apscheduler.schedulers.background import BackgroundScheduler
 from typing import Dict, Any
 
 app = FastAPI(
@@ -21,43 +26,95 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON responses larger than 1 KB for clients that accept gzip
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Analyses precomputed in the background and served from the result store
+ANALYSES = {
+    "customers": analyze_customers,
+    "products": analyze_products,
+    "suppliers": analyze_suppliers,
+    "countries": analyze_countries,
+}
+
+scheduler = BackgroundScheduler()
+
+def refresh_all_analyses():
+    """Recompute every analysis if this worker is the refresh leader"""
+    # The lock outlives one interval so a missed run does not hand leadership over
+    if not is_refresh_leader(ttl=2 * ANALYSIS_REFRESH_INTERVAL):
+        return
+    for name, analyze in ANALYSES.items():
+        try:
+            refresh_analysis(name, analyze)
+        except Exception:
+            # Already logged; keep refreshing the other analyses
+            continue
+
+@app.on_event("startup")
+def startup():
+    """Warm the database connection pool and start the scheduled analysis refreshes"""
+    warm_db_pool()
+    scheduler.add_job(
+        refresh_all_analyses,
+        "interval",
+        seconds=ANALYSIS_REFRESH_INTERVAL,
+        id="refresh_all_analyses",
+        next_run_time=datetime.now()
+    )
+    scheduler.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    """Stop the scheduled analysis refreshes"""
+    scheduler.shutdown(wait=False)
+
+def json_response(payload):
+    """Wrap pre-serialized JSON bytes in a response without re-encoding them"""
+    return Response(content=payload, media_type="application/json")
+
+# Handlers are plain functions so Starlette runs cache misses in its threadpool
 @app.get("/api/customers", response_model=Dict[str, Any])
-async def get_customer_analysis():
+def get_customer_analysis(refresh: bool = False):
     """
     Analyze customer behavior using DBSCAN clustering
     """
     try:
-        return analyze_customers()
+        return json_response(get_cached_analysis("customers", analyze_customers, refresh=refresh))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/products", response_model=Dict[str, Any])
-async def get_product_analysis():
+def get_product_analysis(refresh: bool = False, include_plot: bool = False):
     """
     Analyze product performance using DBSCAN clustering
+    Set include_plot to also return a base64 PNG of the clusters
     """
     try:
-        return analyze_products()
+        if include_plot:
+            # Rendered on demand from the stored products result, so it shows the same clustering
+            return json_response(get_cached_view("products", analyze_products, "plot", plot_products, refresh=refresh))
+        return json_response(get_cached_analysis("products", analyze_products, refresh=refresh))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/suppliers", response_model=Dict[str, Any])
-async def get_supplier_analysis():
+def get_supplier_analysis(refresh: bool = False):
     """
     Analyze supplier performance using DBSCAN clustering
     """
     try:
-        return analyze_suppliers()
+        return json_response(get_cached_analysis("suppliers", analyze_suppliers, refresh=refresh))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/countries", response_model=Dict[str, Any])
-async def get_country_analysis():
+def get_country_analysis(refresh: bool = False):
     """
     Analyze country-based sales patterns using DBSCAN clustering
     """
     try:
-        return analyze_countries()
+        return json_response(get_cached_analysis("countries", analyze_countries, refresh=refresh))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -8,6 +8,39 @@ DB_CONFIG = {
 
 DB_URL = f"postgresql+psycopg2://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
 
+# SQLAlchemy connection pool settings. In production, point DB_CONFIG at
+# PgBouncer (port 6432, pool_mode=transaction) instead of Postgres directly.
+DB_POOL_CONFIG = {
+    'pool_size': 10,
+    'max_overflow': 5,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800
+}
+
 # DBSCAN default parameters
 DEFAULT_MIN_SAMPLES = 3
-DEFAULT_EPS = 0.3 
\ No newline at end of file
+DEFAULT_EPS = 0.3
+
+# Worker processes for the DBSCAN parameter search (-1 uses all cores)
+PARAM_SEARCH_N_JOBS = -1
+
+# Rows sampled (fixed seed) for silhouette scoring in the DBSCAN parameter
+# search; eps and the clusterings themselves always use every row
+PARAM_SEARCH_SAMPLE_SIZE = 2000
+
+# Above this many rows the parameter search switches to sampled-graph SNG-DBSCAN
+SNG_DBSCAN_MIN_ROWS = 5000
+
+# Sampled SNG-DBSCAN pairs whose distances are computed at once (bounds memory)
+SNG_PAIR_CHUNK_SIZE = 1000000
+
+# Seconds between scheduled background recomputes of every analysis
+ANALYSIS_REFRESH_INTERVAL = 600
+
+# Seconds an analysis result is served from cache before being recomputed on
+# request; longer than the refresh interval so scheduled runs keep it fresh
+ANALYSIS_CACHE_TTL = 900
+
+# Set to e.g. "redis://localhost:6379/0" to share results across workers;
+# when None, results are cached in each process
+REDIS_URL = None
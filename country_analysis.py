@@ -1,11 +1,8 @@
-import pandas as pd
 from sklearn.cluster import DBSCAN
-from utils import get_db_connection, standardize_features, find_optimal_parameters, plot_clusters
+from utils import read_sql, standardize_features, find_optimal_parameters
 
 def analyze_countries():
     """Analyze country-based sales patterns using DBSCAN clustering with optimized parameters"""
-    engine = get_db_connection()
-    
     query = """
     SELECT 
         c.country,
@@ -26,37 +23,27 @@ def analyze_countries():
     HAVING COUNT(o.order_id) > 0
     """
     
-    df = pd.read_sql(query, engine)
+    df = read_sql(query)
     
     # Prepare features
-    X = df[["total_orders", "average_order_amount", "products_per_order"]]
+    X = df[["total_orders", "average_order_amount", "products_per_order"]].to_numpy()
     X_scaled = standardize_features(X)
     
     # Find optimal parameters
     eps, min_samples = find_optimal_parameters(X_scaled)
     
     # Apply DBSCAN with optimal parameters
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    df["cluster"] = dbscan.fit_predict(X_scaled)
-    
-    # Plot results
-    plot_clusters(
-        df=df,
-        x_col="total_orders",
-        y_col="average_order_amount",
-        cluster_col="cluster",
-        title=f"Country Sales Pattern Analysis (DBSCAN) - eps={eps:.3f}, min_samples={min_samples}",
-        xlabel="Total Orders",
-        ylabel="Average Order Amount"
-    )
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='euclidean', algorithm='ball_tree', leaf_size=20, n_jobs=-1)
+    labels = dbscan.fit_predict(X_scaled)
+    df["cluster"] = labels
     
     # Get outliers
-    outliers = df[df['cluster'] == -1]
+    outliers = df[labels == -1]
     
     return {
         "total_countries": len(df),
-        "number_of_clusters": len(df['cluster'].unique()) - 1,
-        "outliers_count": len(outliers),
+        "number_of_clusters": int(labels.max()) + 1,
+        "outliers_count": int((labels == -1).sum()),
         "parameters": {
             "eps": eps,
             "min_samples": min_samples
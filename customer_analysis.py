@@ -1,60 +1,57 @@
-import pandas as pd
 from sklearn.cluster import DBSCAN
-from utils import get_db_connection, standardize_features, find_optimal_parameters, plot_clusters
+from utils import read_sql, standardize_features, find_optimal_parameters
 
 def analyze_customers():
     """Analyze customer behavior using DBSCAN clustering with optimized parameters"""
-    engine = get_db_connection()
-    
     query = """
     SELECT 
         c.customer_id,
         c.company_name, 
         COUNT(o.order_id) as total_orders,
-        SUM(od.unit_price * od.quantity * (1 - od.discount)) as total_spends,
-        AVG(od.unit_price * od.quantity) as avg_order_value
+        SUM(sub.order_spend) as total_spends,
+        AVG(sub.order_value) as avg_order_value
     FROM customers c
     INNER JOIN orders o ON c.customer_id = o.customer_id
-    INNER JOIN order_details od ON o.order_id = od.order_id
+    INNER JOIN (
+        SELECT 
+            od.order_id,
+            SUM(od.unit_price * od.quantity * (1 - od.discount)) as order_spend,
+            SUM(od.unit_price * od.quantity) as order_value
+        FROM order_details od
+        GROUP BY od.order_id
+    ) sub ON o.order_id = sub.order_id
     GROUP BY c.customer_id, c.company_name
     HAVING COUNT(o.order_id) > 0
     """
     
-    df = pd.read_sql(query, engine)
+    df = read_sql(query)
     
     # Prepare features
-    X = df[["total_orders", "total_spends", "avg_order_value"]]
+    X = df[["total_orders", "total_spends", "avg_order_value"]].to_numpy()
     X_scaled = standardize_features(X)
     
     # Find optimal parameters
     eps, min_samples = find_optimal_parameters(X_scaled)
     
     # Apply DBSCAN with optimal parameters
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    df["cluster"] = dbscan.fit_predict(X_scaled)
-    
-    # Plot results
-    plot_clusters(
-        df=df,
-        x_col="total_orders",
-        y_col="total_spends",
-        cluster_col="cluster",
-        title=f"Customer Segmentation (DBSCAN) - eps={eps:.3f}, min_samples={min_samples}",
-        xlabel="Total Orders",
-        ylabel="Total Spending"
-    )
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='euclidean', algorithm='ball_tree', leaf_size=20, n_jobs=-1)
+    labels = dbscan.fit_predict(X_scaled)
+    df["cluster"] = labels
     
     # Get outliers
-    outliers = df[df['cluster'] == -1]
+    outliers = df[labels == -1]
     
     return {
         "total_customers": len(df),
-        "number_of_clusters": len(df['cluster'].unique()) - 1,
-        "outliers_count": len(outliers),
+        "number_of_clusters": int(labels.max()) + 1,
+        "outliers_count": int((labels == -1).sum()),
         "parameters": {
             "eps": eps,
             "min_samples": min_samples
         },
         "outliers": outliers[["customer_id", "company_name", "total_orders", "total_spends"]].to_dict('records'),
-        "clusters": df[["customer_id", "company_name", "cluster"]].to_dict('records')
+        # Columnar cluster assignments; company names are sent once in a lookup table
+        "customer_ids": df["customer_id"].tolist(),
+        "clusters": labels.tolist(),
+        "names": dict(zip(df["customer_id"], df["company_name"]))
     } 
\ No newline at end of file
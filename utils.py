@@ -2,93 +2,424 @@ import numpy as np
 import pandas as pd
 import logging
 import io
+import os
+import socket
 import base64
-from sklearn.preprocessing import StandardScaler
+import threading
+import time
+import uuid
+import orjson
 from sklearn.neighbors import NearestNeighbors
+from sklearn.metrics import silhouette_score
+from sklearn.cluster import DBSCAN
 from kneed import KneeLocator
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix
+from scipy.spatial.distance import pdist, squareform
+from scipy.sparse.csgraph import connected_components
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from sqlalchemy import create_engine
-from config import DB_URL
+from matplotlib.colorbar import make_axes
+from sqlalchemy import create_engine, text
+from config import DEFAULT_EPS, DEFAULT_MIN_SAMPLES, DB_URL, DB_POOL_CONFIG, ANALYSIS_CACHE_TTL, REDIS_URL, PARAM_SEARCH_N_JOBS, PARAM_SEARCH_SAMPLE_SIZE, SNG_DBSCAN_MIN_ROWS, SNG_PAIR_CHUNK_SIZE
+
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """Create and return a database connection"""
+# Shared database engine and connection pool, created once at import
+_engine = create_engine(DB_URL, **DB_POOL_CONFIG)
+
+# Serialized analysis results live in Redis when REDIS_URL is set (shared by all
+# workers), otherwise in this process as name -> (timestamp, JSON bytes)
+if REDIS_URL and redis is None:
+    logger.error("REDIS_URL is set but the redis package is not installed")
+    raise ImportError("REDIS_URL is set but the redis package is not installed")
+_redis = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+_analysis_cache = {}
+_analysis_locks = {}
+_analysis_cache_lock = threading.Lock()
+
+# Identifies this process when it holds the scheduled refresh leader lock
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+_LEADER_KEY = "analysis:refresh-leader"
+
+# Extends the leader lock only if this worker still holds it, in one atomic step
+_RENEW_LEADER_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_renew_leader = _redis.register_script(_RENEW_LEADER_SCRIPT) if _redis is not None else None
+
+# One figure is reused for every plot, so plots from concurrent requests are serialized
+_plot_lock = threading.Lock()
+_FIG, _AX = plt.subplots(figsize=(10, 6))
+_CAX, _ = make_axes(_AX)
+
+def read_sql(query):
+    """
+    Run a query on a pooled connection and return the result as a DataFrame
+    Rows are streamed with COPY ... TO STDOUT as CSV and parsed by pandas' C reader
+    instead of being built as Python tuples by the cursor
+    """
+    conn = _engine.raw_connection()
     try:
-        engine = create_engine(DB_URL)
+        buf = io.StringIO()
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", buf)
+        buf.seek(0)
+        # Only empty fields are NULL; strings such as "NA" stay strings
+        return pd.read_csv(buf, keep_default_na=False, na_values=[""])
+    finally:
+        conn.close()
+
+def warm_db_pool():
+    """Open a pooled connection and run a trivial query so the first request does not pay for it"""
+    try:
+        with _engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
         logger.info("Database connection established successfully")
-        return engine
     except Exception as e:
         logger.error(f"Failed to establish database connection: {str(e)}")
         raise
 
+def _get_analysis_lock(name):
+    """Return the (reentrant) lock that serializes computing the named analysis"""
+    with _analysis_cache_lock:
+        return _analysis_locks.setdefault(name, threading.RLock())
+
+def _load_analysis(name, ttl):
+    """Return the stored JSON bytes for an analysis, or None if missing or expired"""
+    if _redis is not None:
+        return _redis.get(f"analysis:{name}")
+    entry = _analysis_cache.get(name)
+    if entry is not None and time.monotonic() - entry[0] < ttl:
+        return entry[1]
+    return None
+
+def _store_analysis(entries, ttl):
+    """Store JSON bytes by name, all at once, so they expire after ttl seconds"""
+    if _redis is not None:
+        # The pipeline runs as MULTI/EXEC, so readers see every entry or none
+        pipe = _redis.pipeline()
+        for name, payload in entries.items():
+            pipe.set(f"analysis:{name}", payload, ex=ttl)
+        pipe.execute()
+    else:
+        now = time.monotonic()
+        for name, payload in entries.items():
+            _analysis_cache[name] = (now, payload)
+
+def _dumps(result):
+    """Serialize an analysis result to JSON bytes"""
+    return orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+def refresh_analysis(name, analyze, ttl=ANALYSIS_CACHE_TTL):
+    """
+    Run an analysis, store its serialized result and return the JSON bytes
+    Each result is stored with a new version id, so views rendered from the
+    previous result (see get_cached_view) are no longer served
+    """
+    with _get_analysis_lock(name):
+        try:
+            logger.info(f"Computing {name} analysis")
+            payload = _dumps(analyze())
+            _store_analysis({name: payload, f"{name}:version": uuid.uuid4().hex.encode()}, ttl)
+            if _redis is None:
+                # Drop in-process views of older versions; Redis expires them by ttl
+                for key in [k for k in list(_analysis_cache) if k.startswith(f"{name}_")]:
+                    _analysis_cache.pop(key, None)
+            return payload
+        except Exception as e:
+            logger.error(f"Failed to refresh {name} analysis: {str(e)}", exc_info=True)
+            raise
+
+def get_cached_analysis(name, analyze, refresh=False, ttl=ANALYSIS_CACHE_TTL):
+    """
+    Return the stored result of an analysis as JSON bytes, computing it when
+    there is no fresh entry or when refresh is requested
+    """
+    if not refresh:
+        payload = _load_analysis(name, ttl)
+        if payload is not None:
+            logger.info(f"Serving cached {name} analysis")
+            return payload
+
+    # Only one caller recomputes a given analysis, the others wait for its result
+    with _get_analysis_lock(name):
+        if not refresh:
+            payload = _load_analysis(name, ttl)
+            if payload is not None:
+                return payload
+        return refresh_analysis(name, analyze, ttl)
+
+def get_cached_view(name, analyze, view, render, refresh=False, ttl=ANALYSIS_CACHE_TTL):
+    """
+    Return a view of a stored analysis result, such as its plot, as JSON bytes
+    render receives the stored result and returns the view; it is only called when
+    the view is missing or refresh is requested. Views are stored under the result's
+    version id, so a view never disagrees with the analysis it was rendered from
+    """
+    if not refresh:
+        version = _load_analysis(f"{name}:version", ttl)
+        if version is not None:
+            payload = _load_analysis(f"{name}_{view}:{version.decode()}", ttl)
+            if payload is not None:
+                logger.info(f"Serving cached {name} {view}")
+                return payload
+
+    with _get_analysis_lock(name):
+        if refresh:
+            refresh_analysis(name, analyze, ttl)
+        # The version is read before the result: if another worker refreshes in between,
+        # the view is stored under the old version, which readers no longer ask for
+        version = _load_analysis(f"{name}:version", ttl)
+        result = _load_analysis(name, ttl)
+        if version is None or result is None:
+            refresh_analysis(name, analyze, ttl)
+            version = _load_analysis(f"{name}:version", ttl)
+            result = _load_analysis(name, ttl)
+        key = f"{name}_{view}:{version.decode()}"
+        payload = _load_analysis(key, ttl)
+        if payload is None:
+            logger.info(f"Rendering {name} {view}")
+            payload = _dumps(render(orjson.loads(result)))
+            _store_analysis({key: payload}, ttl)
+        return payload
+
+def is_refresh_leader(ttl):
+    """
+    Return whether this process should run the scheduled analysis refreshes
+    With Redis, one worker holds a SET NX lock for ttl seconds and renews it on each
+    run, so results are computed once for all workers; without Redis every process
+    refreshes its own cache
+    """
+    if _redis is None:
+        return True
+    if _redis.set(_LEADER_KEY, _WORKER_ID, nx=True, ex=ttl):
+        logger.info(f"Worker {_WORKER_ID} is now the analysis refresh leader")
+        return True
+    return bool(_renew_leader(keys=[_LEADER_KEY], args=[_WORKER_ID, ttl]))
+
 def standardize_features(X):
-    """Standardize features using StandardScaler"""
+    """Standardize features to zero mean and unit variance (same scaling as StandardScaler)"""
     try:
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        # Stay in float64: eps is an exact k-distance, so float32 rounding would
+        # change which boundary points count as neighbors
+        X = np.asarray(X, dtype=np.float64)
+        mean = X.mean(axis=0)
+        std = X.std(axis=0)
+        # Leave constant columns centered rather than dividing by zero
+        std[std == 0] = 1
+        X_scaled = (X - mean) / std
         logger.info("Features standardized successfully")
         return X_scaled
     except Exception as e:
         logger.error(f"Failed to standardize features: {str(e)}")
         raise
 
+def _elbow_eps(k_distances, min_samples):
+    """Return eps at the elbow of the sorted k-distance curve, or None if there is no elbow"""
+    distances = np.sort(k_distances)
+    kneedle = KneeLocator(range(len(distances)), distances, curve='convex', direction='increasing')
+    if kneedle.elbow is None:
+        logger.warning(f"No elbow found for min_samples={min_samples}")
+        return None
+    return distances[kneedle.elbow]
+
+def _score_labels(labels, D, eps, min_samples, sample_idx=None):
+    """
+    Silhouette score of a clustering from precomputed distances D, restricted to
+    sample_idx when D only covers a sample of the rows
+    Returns None if the clustering (or its sample) does not have a valid number of labels
+    """
+    # Skip if all points are noise or only one cluster
+    if len(np.unique(labels)) <= 1:
+        logger.warning(f"Invalid clustering for eps={eps:.3f}, min_samples={min_samples}")
+        return None
+    
+    if sample_idx is not None:
+        labels = labels[sample_idx]
+    if not 2 <= len(np.unique(labels)) <= len(labels) - 1:
+        logger.warning(f"Sample cannot be scored for eps={eps:.3f}, min_samples={min_samples}")
+        return None
+    
+    score = silhouette_score(D, labels, metric='precomputed')
+    logger.info(f"Score for eps={eps:.3f}, min_samples={min_samples}: {score:.3f}")
+    return score
+
+def _best_parameters(results):
+    """
+    Pick the highest-scoring (score, eps, min_samples) result, falling back to
+    the configured defaults when no candidate produced a valid clustering
+    """
+    if not results:
+        logger.warning("No valid parameters found, using defaults")
+        best_eps, best_min_samples = DEFAULT_EPS, DEFAULT_MIN_SAMPLES
+    else:
+        _, best_eps, best_min_samples = max(results, key=lambda r: r[0])
+    
+    logger.info(f"Optimal parameters found: eps={best_eps:.3f}, min_samples={best_min_samples}")
+    return float(best_eps), int(best_min_samples)
+
+def _eval_min_samples(min_samples, eps, graph, D, sample_idx):
+    """
+    Cluster with one (eps, min_samples) candidate on the precomputed radius graph and score it
+    Returns (score, eps, min_samples), or None if no valid clustering was found
+    """
+    logger.info(f"Testing min_samples={min_samples}")
+    # DBSCAN.fit sets the diagonal of a sparse precomputed graph in place, and
+    # joblib hands large graphs to workers as read-only memmaps, so fit a copy
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+    labels = dbscan.fit_predict(graph.copy())
+    
+    score = _score_labels(labels, D, eps, min_samples, sample_idx)
+    if score is None:
+        return None
+    return score, eps, min_samples
+
+def _sng_dbscan_labels(X_scaled, eps, core, neighbor_distances, neighbor_indices, sampling_rate, rng):
+    """
+    Cluster with SNG-DBSCAN: connect core points through a sampled eps-neighborhood
+    graph instead of every pair, then label its connected components
+    core marks the points whose exact min_samples-distance is within eps; the
+    graph holds each point's k nearest neighbors within eps plus random pairs within eps
+    Returns labels in the same format as DBSCAN (noise is -1)
+    """
+    n = len(X_scaled)
+    labels = np.full(n, -1)
+    if not core.any():
+        return labels
+    
+    # Nearest-neighbor edges within eps, already known from the k-distance query
+    k = neighbor_indices.shape[1]
+    knn_rows = np.repeat(np.arange(n), k)
+    knn_cols = neighbor_indices.ravel()
+    knn_keep = (knn_rows != knn_cols) & (neighbor_distances.ravel() <= eps)
+    
+    # Each point also draws ceil(sampling_rate * n) random partners; keep the pairs
+    # within eps. Pairs are generated in chunks so at most SNG_PAIR_CHUNK_SIZE
+    # pair differences are held in memory at once
+    partners_per_point = max(1, int(np.ceil(sampling_rate * n)))
+    chunk_rows = max(1, SNG_PAIR_CHUNK_SIZE // partners_per_point)
+    rows_parts = [knn_rows[knn_keep]]
+    cols_parts = [knn_cols[knn_keep]]
+    for start in range(0, n, chunk_rows):
+        rows = np.repeat(np.arange(start, min(start + chunk_rows, n)), partners_per_point)
+        cols = rng.integers(0, n, size=len(rows))
+        keep = (rows != cols) & (np.linalg.norm(X_scaled[rows] - X_scaled[cols], axis=1) <= eps)
+        rows_parts.append(rows[keep])
+        cols_parts.append(cols[keep])
+    
+    rows = np.concatenate(rows_parts)
+    cols = np.concatenate(cols_parts)
+    graph = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    graph = graph.maximum(graph.T).tocsr()
+    
+    core_idx = np.flatnonzero(core)
+    _, labels[core_idx] = connected_components(graph[core_idx][:, core_idx], directed=False)
+    
+    # Border points join the cluster of their first core neighbor in the graph
+    border_idx = np.flatnonzero(~core)
+    border_graph = graph[border_idx][:, core_idx]
+    has_core_neighbor = np.diff(border_graph.indptr) > 0
+    first_neighbor = border_graph.indices[border_graph.indptr[:-1][has_core_neighbor]]
+    labels[border_idx[has_core_neighbor]] = labels[core_idx[first_neighbor]]
+    
+    return labels
+
+def _sng_dbscan_params(X_scaled, min_samples_range=(2, 10), sample_size=2000, random_state=0):
+    """
+    Find eps and min_samples for large inputs using SNG-DBSCAN, connecting core
+    points through a sampled graph instead of the full eps-radius graph
+    Returns optimal eps and min_samples
+    """
+    n = len(X_scaled)
+    rng = np.random.default_rng(random_state)
+    # s = log(n)/n, the SNG-DBSCAN rate: about ln(n) random partners per point.
+    # Local connectivity already comes from the nearest-neighbor edges, so the
+    # random pairs only need to bridge what those miss
+    sampling_rate = min(1.0, np.log(n) / n)
+    logger.info(f"Using SNG-DBSCAN parameter search for {n} rows (sampling rate {sampling_rate:.4f})")
+    
+    # Exact k-distances of every point decide eps and which points are core
+    neighbors = NearestNeighbors(n_neighbors=min_samples_range[1], algorithm='kd_tree').fit(X_scaled)
+    all_distances, all_indices = neighbors.kneighbors(X_scaled)
+    
+    # Silhouette scores are computed on a fixed sample of the rows
+    sample_idx = rng.choice(n, min(n, sample_size), replace=False)
+    D_sample = squareform(pdist(X_scaled[sample_idx]))
+    
+    results = []
+    for min_samples in range(min_samples_range[0], min_samples_range[1] + 1):
+        logger.info(f"Testing min_samples={min_samples}")
+        k_distances = all_distances[:, min_samples-1]
+        eps = _elbow_eps(k_distances, min_samples)
+        if eps is None:
+            continue
+        
+        core = k_distances <= eps
+        labels = _sng_dbscan_labels(X_scaled, eps, core, all_distances, all_indices, sampling_rate, rng)
+        score = _score_labels(labels, D_sample, eps, min_samples, sample_idx)
+        if score is not None:
+            results.append((score, eps, min_samples))
+    
+    return _best_parameters(results)
+
 def find_optimal_parameters(X_scaled, min_samples_range=(2, 10)):
     """
     Find optimal eps and min_samples values for DBSCAN using the elbow method
+    eps and the candidate clusterings use every row; silhouette scores use a
+    fixed sample of at most PARAM_SEARCH_SAMPLE_SIZE rows
     Returns optimal eps and min_samples
     """
     try:
         logger.info("Starting parameter optimization...")
-        best_eps = None
-        best_min_samples = None
-        best_score = float('-inf')
+        n = len(X_scaled)
+        
+        # Large inputs connect clusters through a sampled graph instead
+        if n > SNG_DBSCAN_MIN_ROWS:
+            return _sng_dbscan_params(X_scaled, min_samples_range, PARAM_SEARCH_SAMPLE_SIZE)
+        
+        # Query the k-distances once for the largest min_samples; smaller values
+        # read their column from the same (row-wise sorted) result
+        neighbors = NearestNeighbors(n_neighbors=min_samples_range[1], algorithm='kd_tree').fit(X_scaled)
+        all_distances, _ = neighbors.kneighbors(X_scaled)
         
+        candidates = []
         for min_samples in range(min_samples_range[0], min_samples_range[1] + 1):
-            logger.info(f"Testing min_samples={min_samples}")
-            
-            # Find optimal eps for current min_samples
-            neighbors = NearestNeighbors(n_neighbors=min_samples).fit(X_scaled)
-            distances, _ = neighbors.kneighbors(X_scaled)
-            distances = np.sort(distances[:, min_samples-1])
-            
-            kneedle = KneeLocator(range(len(distances)), distances, curve='convex', direction='increasing')
-            if kneedle.elbow is None:
-                logger.warning(f"No elbow found for min_samples={min_samples}")
-                continue
-                
-            eps = distances[kneedle.elbow]
-            
-            # Calculate silhouette score for current parameters
-            from sklearn.metrics import silhouette_score
-            from sklearn.cluster import DBSCAN
-            
-            dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-            labels = dbscan.fit_predict(X_scaled)
-            
-            # Skip if all points are noise or only one cluster
-            if len(np.unique(labels)) <= 1:
-                logger.warning(f"Invalid clustering for eps={eps:.3f}, min_samples={min_samples}")
-                continue
-                
-            score = silhouette_score(X_scaled, labels)
-            logger.info(f"Score for eps={eps:.3f}, min_samples={min_samples}: {score:.3f}")
-            
-            if score > best_score:
-                best_score = score
-                best_eps = eps
-                best_min_samples = min_samples
+            eps = _elbow_eps(all_distances[:, min_samples-1], min_samples)
+            if eps is not None:
+                candidates.append((min_samples, eps))
+        if not candidates:
+            return _best_parameters([])
+        
+        # One sparse radius graph from the same tree, wide enough for every
+        # candidate eps, is shared by all DBSCAN fits; its distances are exact,
+        # so the point defining eps stays inside its own radius
+        graph = neighbors.radius_neighbors_graph(X_scaled, radius=max(eps for _, eps in candidates), mode='distance')
         
-        # If no valid parameters found, use defaults
-        if best_eps is None:
-            logger.warning("No valid parameters found, using defaults")
-            best_eps = 0.3
-            best_min_samples = 3
+        # Exact pairwise distances of the rows used for silhouette scoring
+        sample_idx = None
+        if n > PARAM_SEARCH_SAMPLE_SIZE:
+            sample_idx = np.random.default_rng(0).choice(n, PARAM_SEARCH_SAMPLE_SIZE, replace=False)
+            logger.info(f"Scoring on a sample of {PARAM_SEARCH_SAMPLE_SIZE} of {n} rows")
+        D = squareform(pdist(X_scaled if sample_idx is None else X_scaled[sample_idx]))
         
-        logger.info(f"Optimal parameters found: eps={best_eps:.3f}, min_samples={best_min_samples}")
-        return best_eps, best_min_samples
+        # Each min_samples candidate is independent, so evaluate them in parallel
+        results = Parallel(n_jobs=PARAM_SEARCH_N_JOBS, backend='loky')(
+            delayed(_eval_min_samples)(min_samples, eps, graph, D, sample_idx)
+            for min_samples, eps in candidates
+        )
+        return _best_parameters([r for r in results if r is not None])
         
     except Exception as e:
         logger.error(f"Error in parameter optimization: {str(e)}", exc_info=True)
@@ -97,20 +428,20 @@ def find_optimal_parameters(X_scaled, min_samples_range=(2, 10)):
 def plot_clusters(df, x_col, y_col, cluster_col, title, xlabel, ylabel):
     """Create a scatter plot of clusters and return as base64 image"""
     try:
-        plt.figure(figsize=(10, 6))
-        plt.scatter(df[x_col], df[y_col], c=df[cluster_col], cmap='plasma', s=60)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.title(title)
-        plt.grid(True)
-        plt.colorbar(label='Cluster No')
-        
-        # Convert plot to base64
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        img_str = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close()
+        with _plot_lock:
+            _AX.clear()
+            _CAX.clear()
+            points = _AX.scatter(df[x_col], df[y_col], c=df[cluster_col], cmap='plasma', s=60)
+            _AX.set_xlabel(xlabel)
+            _AX.set_ylabel(ylabel)
+            _AX.set_title(title)
+            _AX.grid(True)
+            _FIG.colorbar(points, cax=_CAX, label='Cluster No')
+            
+            # Convert plot to base64
+            buf = io.BytesIO()
+            _FIG.savefig(buf, format='png', dpi=80)
+            img_str = base64.b64encode(buf.getbuffer()).decode('utf-8')
         
         logger.info("Cluster plot generated successfully")
         return img_str